@@ -1,36 +1,236 @@
 import asyncio
+import collections
+import copy
 import functools
+import itertools
+import json
+import logging
+import random
+import time
 
 import aiohttp
 import jsonrpc_base
-from jsonrpc_base import TransportError
+import multidict
+from jsonrpc_base import ProtocolError, TransportError
+from jsonrpc_base.jsonrpc import Method
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+_LOGGER = logging.getLogger(__name__)
+
+# Message ids only need to be unique within a session, so a counter from
+# a random offset is enough and much cheaper than a fresh uuid per call.
+_id_counter = itertools.count(random.randint(1, 1 << 30))
+
+# C-accelerated JSON string escaping, for emitting envelopes directly.
+_encode_json_str = json.encoder.encode_basestring_ascii
+
+# Template for the request envelope; copying it hits CPython's dict-copy
+# fast path instead of re-hashing the static key per request.
+_ENVELOPE = {'jsonrpc': '2.0'}
+
+if orjson is not None:
+    _dumps = orjson.dumps
+else:
+    def _dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+
+def _cache_key(message):
+    """Build a cache key from a request's method and canonical params.
+
+    Params are encoded with sorted keys so that by-name calls hit the
+    same entry regardless of argument order.
+    """
+    params = message.params
+    if isinstance(params, tuple):
+        params = list(params)
+    if orjson is not None:
+        encoded = orjson.dumps(params, option=orjson.OPT_SORT_KEYS)
+    else:
+        encoded = json.dumps(params, sort_keys=True)
+    return (message.method, encoded)
+
+
+def _serialize(message):
+    """Serialize an outgoing message to UTF-8 JSON bytes.
+
+    Requests are encoded directly so that orjson can be used when it is
+    available, and so that aiohttp receives bytes and skips re-encoding
+    the payload. Other message types fall back to their own serializers.
+
+    The encoded bytes are memoized on the message, so serializing the
+    same message again (e.g. for instrumentation or retries) is free.
+    """
+    cached = getattr(message, '_serialized', None)
+    if cached is not None:
+        return cached
+    if type(message) is jsonrpc_base.Request:
+        if not message.params and isinstance(message.msg_id, int):
+            # No-params requests (heartbeats, pollers) have a fixed
+            # envelope, so emit the wire bytes directly and skip both
+            # the dict build and the generic encoder dispatch.
+            serialized = b'{"jsonrpc": "2.0", "method": %s, "id": %d}' % (
+                _encode_json_str(message.method).encode('ascii'),
+                message.msg_id)
+        else:
+            data = _ENVELOPE.copy()
+            data['method'] = message.method
+            if message.params:
+                params = message.params
+                if isinstance(params, tuple):
+                    params = list(params)
+                data['params'] = params
+            if message.msg_id is not None:
+                data['id'] = message.msg_id
+            try:
+                serialized = _dumps(data)
+            except TypeError:
+                # orjson supports fewer types than the stdlib encoder;
+                # let the message serialize itself in that case.
+                serialized = message.serialize().encode('utf-8')
+    else:
+        serialized = message.serialize().encode('utf-8')
+    message._serialized = serialized
+    return serialized
 
 
 class Server(jsonrpc_base.Server):
     """A connection to a HTTP JSON-RPC server, backed by aiohttp"""
 
-    def __init__(self, url, session=None, *, loads=None, **post_kwargs):
+    def __init__(
+            self, url, session=None, *, loads=None, cache=None,
+            id_generator=None, **post_kwargs):
         super().__init__()
-        object.__setattr__(self, 'session', session or aiohttp.ClientSession())
-        post_kwargs['headers'] = post_kwargs.get('headers', {})
-        post_kwargs['headers']['Content-Type'] = post_kwargs['headers'].get(
-            'Content-Type', 'application/json')
-        post_kwargs['headers']['Accept'] = post_kwargs['headers'].get(
-            'Accept', 'application/json-rpc')
-        self._request = functools.partial(
-            self.session.post, url, **post_kwargs)
-
-        self._json_args = {}
+        self._session = session
+        # Message ids come from the shared counter unless a custom
+        # iterator is supplied (e.g. a deterministic one in tests).
+        self._id_generator = (
+            id_generator if id_generator is not None else _id_counter)
+        # Build the headers as a CIMultiDict up front so aiohttp doesn't
+        # have to re-normalize a plain dict on every request.
+        headers = multidict.CIMultiDict(post_kwargs.get('headers', {}))
+        headers.setdefault('Content-Type', 'application/json')
+        headers.setdefault('Accept', 'application/json-rpc')
+        post_kwargs['headers'] = headers
+        self._url = url
+        self._post_kwargs = post_kwargs
+        self._request = None
+
         if loads is not None:
-            self._json_args['loads'] = loads
+            self._loads = loads
+        elif orjson is not None:
+            self._loads = orjson.loads
+        else:
+            self._loads = json.loads
+
+        self._bound_methods = {}
+
+        self._cache = None
+        if cache is not None:
+            self._cache = collections.OrderedDict()
+            self._cache_methods = frozenset(cache['methods'])
+            self._cache_ttl = cache.get('ttl', 300)
+            self._cache_maxsize = cache.get('maxsize', 10000)
+
+    @property
+    def session(self):
+        """The aiohttp ClientSession, created on first use if needed.
+
+        Deferring creation keeps Server construction valid outside a
+        running event loop, which newer aiohttp releases require for
+        ClientSession().
+        """
+        if self._session is None:
+            _LOGGER.warning(
+                'Creating a per-Server ClientSession; pass a shared session '
+                'to reuse connections across servers')
+            self._session = aiohttp.ClientSession()
+        return self._session
+
+    def __getattr__(self, method_name):
+        if method_name[:1] == '_':  # prevent calls for private methods
+            raise AttributeError("invalid attribute '%s'" % method_name)
+        return self.bind(method_name)
+
+    def bind(self, method_name):
+        """Return a cached callable proxy for a method name.
+
+        Attribute access builds a fresh proxy per lookup; bind builds it
+        once, which matters for clients calling a fixed set of methods
+        at a high rate. Dotted names (e.g. 'app.users.getUsers') work
+        the same as nested attribute access.
+        """
+        method = self._bound_methods.get(method_name)
+        if method is None:
+            method = Method(
+                self._rpc_request, self._register_handler, method_name)
+            self._bound_methods[method_name] = method
+        return method
+
+    def _register_handler(self, method_name, callback):
+        """Register a callback for if the server sends this request."""
+        self._server_request_handlers[method_name] = callback
+
+    def _rpc_request(self, method_name, args=None, kwargs=None):
+        """Perform the actual RPC call.
+
+        If _notification=True, don't wait for a response
+        """
+        if kwargs.pop('_notification', False):
+            msg_id = None
+        else:
+            msg_id = next(self._id_generator)
+
+        if args and kwargs:
+            raise ProtocolError(
+                'JSON-RPC spec forbids mixing arguments and keyword arguments')
+
+        return self.send_message(
+            jsonrpc_base.Request(method_name, args or kwargs, msg_id))
+
+    async def call_many(self, *calls):
+        """Run multiple RPC calls concurrently and return their results.
+
+        Results are returned in call order. Calls that fail have their
+        exception instance returned in place of a result, so one failed
+        call doesn't discard the results of the others.
+        """
+        return await asyncio.gather(*calls, return_exceptions=True)
 
     async def send_message(self, message):
         """Send the HTTP message to the server and return the message response.
 
         No result is returned if message is a notification.
+
+        Results for methods in the cache allowlist are served from the
+        cache when a fresh entry exists, skipping the round-trip.
         """
+        cache_key = None
+        if (self._cache is not None and message.response_id is not None
+                and getattr(message, 'method', None) in self._cache_methods):
+            cache_key = _cache_key(message)
+            cached = self._cache.get(cache_key)
+            if cached is not None:
+                if time.monotonic() - cached[1] < self._cache_ttl:
+                    self._cache.move_to_end(cache_key)
+                    return copy.deepcopy(cached[0])
+                del self._cache[cache_key]
+
+        request = self._request
+        if request is None:
+            request = self._request = functools.partial(
+                self.session.post, self._url, **self._post_kwargs)
+
+        # Wrapping the body ourselves skips aiohttp's payload-type
+        # dispatch; the content type is already fixed by our headers.
+        body = aiohttp.BytesPayload(
+            _serialize(message), content_type='application/json')
         try:
-            response = await self._request(data=message.serialize())
+            response = await request(data=body)
         except (aiohttp.ClientError, asyncio.TimeoutError) as exc:
             raise TransportError('Transport Error', message, exc)
 
@@ -39,16 +239,28 @@ class Server(jsonrpc_base.Server):
                 'HTTP %d %s' % (response.status, response.reason), message)
 
         if message.response_id is None:
-            # Message is notification, so no response is expcted.
+            # Message is notification, so no response is expected.
+            # Release the connection back to the pool right away instead
+            # of holding it until the response object is collected.
+            response.release()
             return None
 
         try:
-            response_data = await response.json(**self._json_args)
+            # Read the raw body and decode it ourselves: JSON-RPC bodies
+            # are always JSON, so aiohttp's content-type sniffing and
+            # intermediate str decode in response.json() are pure
+            # overhead, and orjson consumes the bytes natively.
+            response_data = self._loads(await response.read())
         except ValueError as value_error:
             raise TransportError(
                 'Cannot deserialize response body', message, value_error)
 
-        return message.parse_response(response_data)
+        result = message.parse_response(response_data)
+        if cache_key is not None:
+            self._cache[cache_key] = (copy.deepcopy(result), time.monotonic())
+            if len(self._cache) > self._cache_maxsize:
+                self._cache.popitem(last=False)
+        return result
 
     async def __aenter__(self):
         await self.session.__aenter__()
@@ -22,6 +22,9 @@ setup(
         'jsonrpc-base>=2.1.0',
         'aiohttp>=3.0.0',
     ],
+    extras_require={
+        'speedups': ['orjson'],
+    },
     classifiers=[
         'Development Status :: 5 - Production/Stable',
         'Intended Audience :: Developers',
@@ -1,5 +1,6 @@
 import asyncio
 from unittest import mock
+import itertools
 import json
 import pytest
 
@@ -10,107 +11,126 @@ import aiohttp.test_utils
 import jsonrpc_base
 from jsonrpc_async import Server, ProtocolError, TransportError
 
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
 
-async def test_send_message_timeout(aiohttp_client):
-    """Test the catching of the timeout responses."""
+try:
+    import orjson
+    fast_loads = orjson.loads
+    fast_dumps = orjson.dumps
+except ImportError:
+    fast_loads = json.loads
 
-    async def handler(request):
-        try:
-            await asyncio.sleep(10)
-        except asyncio.CancelledError:
-            # Event loop will be terminated before sleep finishes
-            pass
-        return aiohttp.web.Response(text='{}', content_type='application/json')
-
-    def create_app():
-        app = aiohttp.web.Application()
+    def fast_dumps(obj):
+        return json.dumps(obj).encode('utf-8')
+
+
+@pytest.fixture(scope='session')
+def event_loop_policy():
+    """Run the suite on uvloop when it's installed."""
+    if uvloop is not None:
+        return uvloop.EventLoopPolicy()
+    return asyncio.DefaultEventLoopPolicy()
+
+
+def make_app(handler=None):
+    """Build a test application routing POST requests to handler."""
+    app = aiohttp.web.Application()
+    if handler is not None:
         app.router.add_route('POST', '/', handler)
-        return app
+    return app
+
+
+def json_response(body, status=200):
+    """Build an application/json response from prebuilt body bytes."""
+    return aiohttp.web.Response(
+        body=body, content_type='application/json', status=status)
+
+
+# Response bodies shared by many handlers, built once as bytes.
+RESULT_TRUE_BODY = b'{"jsonrpc": "2.0", "result": true, "id": 1}'
+RESULT_FALSE_BODY = b'{"jsonrpc": "2.0", "result": false, "id": 1}'
+RESULT_19_BODY = b'{"jsonrpc": "2.0", "result": 19, "id": 1}'
+RESULT_NULL_BODY = b'{"jsonrpc": "2.0", "result": null}'
 
-    client = await aiohttp_client(create_app())
-    server = Server('/', client, timeout=0.2)
+# Requests carry no per-test state, so the common one is shared rather
+# than rebuilt in every scenario.
+MY_METHOD_REQUEST = jsonrpc_base.Request('my_method', params=None, msg_id=1)
+
+
+async def test_send_message_timeout():
+    """Test the catching of the timeout responses."""
+    async def callback(*args, **kwargs):
+        # What aiohttp raises when the configured timeout elapses,
+        # without spending real wall-clock time waiting for it.
+        raise asyncio.TimeoutError()
+
+    session = mock.Mock()
+    session.post = callback
+    server = Server('/', session, timeout=0.2)
 
     with pytest.raises(TransportError) as transport_error:
-        await server.send_message(jsonrpc_base.Request(
-            'my_method', params=None, msg_id=1))
+        await server.send_message(MY_METHOD_REQUEST)
 
     assert isinstance(transport_error.value.args[1], asyncio.TimeoutError)
 
 
-async def test_send_message(aiohttp_client):
-    """Test the sending of messages."""
-    # catch non-json responses
-    async def handler1(request):
-        return aiohttp.web.Response(
-            text='not json', content_type='application/json')
-
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler1)
-        return app
+async def test_send_message_bad_json(aiohttp_client):
+    """Test the catching of non-json responses."""
+    async def handler(request):
+        return json_response(b'not json')
 
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler))
     server = Server('/', client)
 
     with pytest.raises(TransportError) as transport_error:
-        await server.send_message(
-            jsonrpc_base.Request('my_method', params=None, msg_id=1))
+        await server.send_message(MY_METHOD_REQUEST)
 
     assert transport_error.value.args[0] == (
         "Error calling method 'my_method': Cannot deserialize response body")
     assert isinstance(transport_error.value.args[1], ValueError)
 
-    # catch non-200 responses
-    async def handler2(request):
-        return aiohttp.web.Response(
-            text='{}', content_type='application/json', status=404)
 
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler2)
-        return app
+async def test_send_message_http_error(aiohttp_client):
+    """Test the catching of non-200 responses."""
+    async def handler(request):
+        return json_response(b'{}', status=404)
 
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler))
     server = Server('/', client)
 
     with pytest.raises(TransportError) as transport_error:
-        await server.send_message(jsonrpc_base.Request(
-            'my_method', params=None, msg_id=1))
+        await server.send_message(MY_METHOD_REQUEST)
 
     assert transport_error.value.args[0] == (
         "Error calling method 'my_method': HTTP 404 Not Found")
 
-    # catch aiohttp own exception
+
+async def test_send_message_aiohttp_exception():
+    """Test the catching of aiohttp's own exceptions."""
     async def callback(*args, **kwargs):
         raise aiohttp.ClientOSError('aiohttp exception')
 
-    def create_app():
-        app = aiohttp.web.Application()
-        return app
-
-    client = await aiohttp_client(create_app())
-    client.post = callback
-    server = Server('/', client)
+    session = mock.Mock()
+    session.post = callback
+    server = Server('/', session)
 
     with pytest.raises(TransportError) as transport_error:
-        await server.send_message(jsonrpc_base.Request(
-            'my_method', params=None, msg_id=1))
+        await server.send_message(MY_METHOD_REQUEST)
 
     assert transport_error.value.args[0] == (
         "Error calling method 'my_method': Transport Error")
 
 
-async def test_exception_passthrough(aiohttp_client):
+async def test_exception_passthrough():
     async def callback(*args, **kwargs):
         raise aiohttp.ClientOSError('aiohttp exception')
 
-    def create_app():
-        app = aiohttp.web.Application()
-        return app
-
-    client = await aiohttp_client(create_app())
-    client.post = callback
-    server = Server('/', client)
+    session = mock.Mock()
+    session.post = callback
+    server = Server('/', session)
 
     with pytest.raises(TransportError) as transport_error:
         await server.foo()
@@ -120,14 +140,9 @@ async def test_exception_passthrough(aiohttp_client):
     assert isinstance(transport_error.value.args[1], aiohttp.ClientOSError)
 
 
-async def test_forbid_private_methods(aiohttp_client):
+async def test_forbid_private_methods():
     """Test that we can't call private methods (those starting with '_')."""
-    def create_app():
-        app = aiohttp.web.Application()
-        return app
-
-    client = await aiohttp_client(create_app())
-    server = Server('/', client)
+    server = Server('/', mock.Mock())
 
     with pytest.raises(AttributeError):
         await server._foo()
@@ -140,16 +155,9 @@ async def test_forbid_private_methods(aiohttp_client):
 async def test_headers_passthrough(aiohttp_client):
     """Test that we correctly send RFC headers and merge them with users."""
     async def handler(request):
-        return aiohttp.web.Response(
-            text='{"jsonrpc": "2.0", "result": true, "id": 1}',
-            content_type='application/json')
+        return json_response(RESULT_TRUE_BODY)
 
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler)
-        return app
-
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler))
 
     original_post = client.post
 
@@ -170,14 +178,9 @@ async def test_headers_passthrough(aiohttp_client):
     await server.foo()
 
 
-async def test_method_call(aiohttp_client):
+async def test_method_call():
     """Mixing *args and **kwargs is forbidden by the spec."""
-    def create_app():
-        app = aiohttp.web.Application()
-        return app
-
-    client = await aiohttp_client(create_app())
-    server = Server('/', client)
+    server = Server('/', mock.Mock())
 
     with pytest.raises(ProtocolError) as error:
         await server.testmethod(1, 2, a=1, b=2)
@@ -188,96 +191,155 @@ async def test_method_call(aiohttp_client):
 async def test_method_nesting(aiohttp_client):
     """Test that we correctly nest namespaces."""
     async def handler(request):
-        request_message = await request.json()
+        request_message = fast_loads(await request.read())
         if (request_message["params"][0] == request_message["method"]):
-            return aiohttp.web.Response(
-                text='{"jsonrpc": "2.0", "result": true, "id": 1}',
-                content_type='application/json')
+            return json_response(RESULT_TRUE_BODY)
         else:
-            return aiohttp.web.Response(
-                text='{"jsonrpc": "2.0", "result": false, "id": 1}',
-                content_type='application/json')
-
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler)
-        return app
+            return json_response(RESULT_FALSE_BODY)
 
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler))
     server = Server('/', client)
 
-    assert await server.nest.testmethod("nest.testmethod") is True
-    assert await server.nest.testmethod.some.other.method(
+    # the top-level proxy is cached by the Server, and holding on to the
+    # nested proxy avoids rebuilding the chain for the second call
+    testmethod = server.nest.testmethod
+    assert server.nest is server.nest
+    assert await testmethod("nest.testmethod") is True
+    assert await testmethod.some.other.method(
         "nest.testmethod.some.other.method") is True
 
 
+async def test_bind(aiohttp_client):
+    """Test bound method proxies."""
+    async def handler(request):
+        request_message = fast_loads(await request.read())
+        if (request_message["params"][0] == request_message["method"]):
+            return json_response(RESULT_TRUE_BODY)
+        else:
+            return json_response(RESULT_FALSE_BODY)
+
+    client = await aiohttp_client(make_app(handler))
+    server = Server('/', client)
+
+    subtract = server.bind('subtract')
+    assert server.bind('subtract') is subtract
+    assert server.subtract is subtract
+    assert await subtract("subtract") is True
+    assert await server.bind('nest.testmethod')("nest.testmethod") is True
+
+
 async def test_calls(aiohttp_client):
-    """Test RPC call with positional parameters."""
-    async def handler1(request):
-        request_message = await request.json()
-        assert request_message["params"] == [42, 23]
-        return aiohttp.web.Response(
-            text='{"jsonrpc": "2.0", "result": 19, "id": 1}',
-            content_type='application/json')
+    """Test RPC calls with positional and named parameters."""
+    # accepted params and canned response body, keyed by method name
+    responses = {
+        "subtract": (([42, 23], {'y': 23, 'x': 42}), RESULT_19_BODY),
+        "foobar": (([{'foo': 'bar'}],), RESULT_NULL_BODY),
+    }
 
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler1)
-        return app
+    async def handler(request):
+        request_message = fast_loads(await request.read())
+        accepted_params, body = responses[request_message["method"]]
+        assert request_message["params"] in accepted_params
+        return json_response(body)
 
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler))
     server = Server('/', client)
 
-    assert await server.subtract(42, 23) == 19
+    # one dispatching handler serves all three calls, which share a
+    # single in-flight window instead of three sequential round trips
+    assert await server.call_many(
+        server.subtract(42, 23),
+        server.subtract(x=42, y=23),
+        server.foobar({'foo': 'bar'}),
+    ) == [19, 19, None]
 
-    async def handler2(request):
-        request_message = await request.json()
-        assert request_message["params"] == {'y': 23, 'x': 42}
-        return aiohttp.web.Response(
-            text='{"jsonrpc": "2.0", "result": 19, "id": 1}',
-            content_type='application/json')
 
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler2)
-        return app
+async def test_call_many(aiohttp_client):
+    """Test that call_many runs calls concurrently and keeps order."""
+    async def handler(request):
+        request_message = fast_loads(await request.read())
+        return json_response(fast_dumps({
+            "jsonrpc": "2.0",
+            "result": request_message["params"][0],
+            "id": request_message["id"]}))
 
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler))
     server = Server('/', client)
 
+    assert await server.call_many(
+        server.echo(1), server.echo(2), server.echo(3)) == [1, 2, 3]
+
+    # failed calls have their exception returned in place of a result
+    client.post = mock.Mock(side_effect=aiohttp.ClientOSError('boom'))
+    server = Server('/', client)
+    results = await server.call_many(server.echo(1))
+    assert isinstance(results[0], TransportError)
+
+
+async def test_response_cache(aiohttp_client):
+    """Test the opt-in client-side response cache."""
+    handled = []
+
+    async def handler(request):
+        request_message = fast_loads(await request.read())
+        handled.append(request_message["method"])
+        return json_response(fast_dumps({
+            "jsonrpc": "2.0", "result": 19,
+            "id": request_message["id"]}))
+
+    client = await aiohttp_client(make_app(handler))
+    server = Server('/', client, cache={'methods': {'subtract'}, 'ttl': 300})
+
+    # identical allowlisted calls hit the cache after the first
+    assert await server.subtract(42, 23) == 19
+    assert await server.subtract(42, 23) == 19
+    assert len(handled) == 1
+
+    # argument order doesn't matter for by-name params
     assert await server.subtract(x=42, y=23) == 19
+    assert await server.subtract(y=23, x=42) == 19
+    assert len(handled) == 2
+
+    # different params and non-allowlisted methods aren't cached
+    assert await server.subtract(1, 2) == 19
+    await server.other()
+    await server.other()
+    assert len(handled) == 5
 
-    async def handler3(request):
-        request_message = await request.json()
-        assert request_message["params"] == [{'foo': 'bar'}]
-        return aiohttp.web.Response(
-            text='{"jsonrpc": "2.0", "result": null}',
-            content_type='application/json')
 
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler3)
-        return app
+async def test_sequential_message_ids(aiohttp_client):
+    """Test that message ids are generated from a monotonic counter."""
+    seen_ids = []
 
-    client = await aiohttp_client(create_app())
+    async def handler(request):
+        request_message = fast_loads(await request.read())
+        seen_ids.append(request_message["id"])
+        return json_response(fast_dumps({
+            "jsonrpc": "2.0", "result": True,
+            "id": request_message["id"]}))
+
+    client = await aiohttp_client(make_app(handler))
     server = Server('/', client)
 
-    await server.foobar({'foo': 'bar'})
+    await server.foo()
+    await server.foo()
+
+    assert all(isinstance(msg_id, int) for msg_id in seen_ids)
+    assert seen_ids[1] == seen_ids[0] + 1
+
+    # a custom id generator can be injected for deterministic ids
+    server = Server('/', client, id_generator=itertools.count(1))
+    await server.foo()
+    await server.foo()
+    assert seen_ids[2:] == [1, 2]
 
 
 async def test_notification(aiohttp_client):
     """Verify that we ignore the server response."""
     async def handler(request):
-        return aiohttp.web.Response(
-            text='{"jsonrpc": "2.0", "result": 19, "id": 1}',
-            content_type='application/json')
+        return json_response(RESULT_19_BODY)
 
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler)
-        return app
-
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler))
     server = Server('/', client)
 
     assert await server.subtract(42, 23, _notification=True) is None
@@ -285,39 +347,41 @@ async def test_notification(aiohttp_client):
 
 async def test_custom_loads(aiohttp_client):
     """Test RPC call with custom load."""
-    loads_mock = mock.Mock(wraps=json.loads)
+    load_calls = []
+
+    def loads(data):
+        load_calls.append(data)
+        return json.loads(data)
 
     async def handler(request):
-        request_message = await request.json()
+        request_message = fast_loads(await request.read())
         assert request_message["params"] == [42, 23]
-        return aiohttp.web.Response(
-            text='{"jsonrpc": "2.0", "result": 19, "id": 1}',
-            content_type='application/json')
-
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler)
-        return app
+        return json_response(RESULT_19_BODY)
 
-    client = await aiohttp_client(create_app())
-    server = Server('/', client, loads=loads_mock)
+    client = await aiohttp_client(make_app(handler))
+    server = Server('/', client, loads=loads)
 
     assert await server.subtract(42, 23) == 19
-    assert loads_mock.call_count == 1
+    assert len(load_calls) == 1
+
+
+async def test_session_created_lazily():
+    """Test that an unset ClientSession is only created on first use."""
+    server = Server('http://example.com/')
+    assert server._session is None
+
+    session = server.session
+    assert isinstance(session, aiohttp.ClientSession)
+    assert server.session is session
+    await session.close()
 
 
 async def test_context_manager(aiohttp_client):
     # catch non-json responses
     async def handler1(request):
-        return aiohttp.web.Response(
-            text='not json', content_type='application/json')
-
-    def create_app():
-        app = aiohttp.web.Application()
-        app.router.add_route('POST', '/', handler1)
-        return app
+        return json_response(b'not json')
 
-    client = await aiohttp_client(create_app())
+    client = await aiohttp_client(make_app(handler1))
     async with Server('/', client) as server:
         assert isinstance(server, Server)
         assert not server.session.session.closed